@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Benchmark for Chart-IMG Service
+Starts a fake Chart-IMG server and the service, drives /generate-charts and
+/generate-charts/batch at fixed concurrency levels, and reports p50/p95/p99
+latency, requests per second and peak RSS. Results are saved as JSON so a
+later run can be compared against them with --compare.
+
+Usage:
+    python3 benchmark_chart_service.py --concurrency 1,4,16 --requests 48
+    python3 benchmark_chart_service.py --output benchmarks/baseline.json
+    python3 benchmark_chart_service.py --compare benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from fake_chart_img_server import add_fake_arguments, fake_from_args, start_server
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_SCRIPT = os.path.join(SERVICE_DIR, 'chart_img_service_v7_hybrid.py')
+GUNICORN_CONFIG = os.path.join(SERVICE_DIR, 'gunicorn.conf.py')
+
+# Service settings for benchmarks: no quota limits, so the fake's latency and
+# the service itself are what gets measured
+BENCHMARK_SERVICE_ENV = {
+    'CHART_IMG_API_KEY': 'benchmark',
+    'CHART_RATE_LIMIT_PER_SECOND': '100000',
+    'CHART_RATE_LIMIT_BURST': '100000',
+    'CHART_DAILY_BUDGET': '1000000000',
+}
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def process_tree_rss_kb(pid: int) -> int:
+    """Resident memory of a process and its children, in KB"""
+    if os.path.isdir('/proc'):
+        total = 0
+        pending = [pid]
+        while pending:
+            current = pending.pop()
+            try:
+                with open(f'/proc/{current}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1])
+                            break
+                for task in os.listdir(f'/proc/{current}/task'):
+                    with open(f'/proc/{current}/task/{task}/children') as f:
+                        pending.extend(int(child) for child in f.read().split())
+            except (OSError, ValueError):
+                continue
+        return total
+
+    # macOS / BSD: ps covers the main process only
+    try:
+        output = subprocess.run(['ps', '-o', 'rss=', '-p', str(pid)], capture_output=True, text=True).stdout
+        return int(output.strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+class RssSampler:
+    """Track the peak RSS of the service process tree in the background"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, process_tree_rss_kb(self.pid))
+            self._stop.wait(self.interval)
+
+    def reset(self):
+        self.peak_kb = process_tree_rss_kb(self.pid)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def service_command(server: str) -> list:
+    if server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-c', GUNICORN_CONFIG, 'chart_img_service_v7_hybrid:app']
+    return [sys.executable, SERVICE_SCRIPT]
+
+def start_service(server: str, port: int, upstream_url: str, workdir: str, extra_env: dict):
+    """Start the service as a subprocess pointed at the fake upstream"""
+    env = dict(os.environ)
+    env.update(BENCHMARK_SERVICE_ENV)
+    env.update({
+        'CHART_IMG_V2_URL': upstream_url,
+        'CHART_OUTPUT_DIR': os.path.join(workdir, 'charts'),
+        'CHART_SERVICE_PORT': str(port),
+        'PYTHONPATH': os.pathsep.join(filter(None, [SERVICE_DIR, os.environ.get('PYTHONPATH')])),
+    })
+    env.update(extra_env)
+
+    log = open(os.path.join(workdir, 'service.out'), 'w')
+    process = subprocess.Popen(service_command(server), cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode}, see {log.name}")
+        try:
+            if requests.get(f'{base_url}/health', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Service did not become healthy within 30s, see {log.name}")
+
+def make_payload(scenario: str, tickers, args) -> tuple:
+    """Return (path, body) for one benchmark request"""
+    options = {'response_mode': args.response_mode}
+    if scenario == 'batch':
+        return '/generate-charts/batch', {'tickers': tickers, **options}
+    return '/generate-charts', {'ticker': tickers[0], **options}
+
+def run_level(base_url: str, scenario: str, concurrency: int, args, sampler: RssSampler,
+              upstream) -> dict:
+    """Run one scenario at one concurrency level"""
+    per_request = args.batch_size if scenario == 'batch' else 1
+    prefix = f"{scenario[0].upper()}{concurrency}"
+    requests_list = []
+    for i in range(args.requests):
+        if args.reuse_tickers:
+            tickers = [f"BM{j:03d}" for j in range(per_request)]
+        else:
+            # Fresh tickers per run so every request misses the cache
+            tickers = [f"{prefix}X{args.run_id}{i:04d}{j:02d}" for j in range(per_request)]
+        requests_list.append(make_payload(scenario, tickers, args))
+
+    local = threading.local()
+
+    def send(item):
+        path, body = item
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.post(f'{base_url}{path}', json=body, timeout=args.timeout)
+            data = response.json()
+            ok = response.status_code == 200 and bool(data.get('success'))
+            if scenario == 'batch':
+                charts = sum(r.get('success_count', 0) for r in data.get('results', {}).values())
+            else:
+                charts = data.get('success_count', 0)
+            status = response.status_code
+        except (requests.RequestException, ValueError) as e:
+            ok, charts, status = False, 0, type(e).__name__
+        return time.perf_counter() - started, ok, charts, status
+
+    calls_before = upstream.stats()['calls']
+    sampler.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, requests_list))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(outcome[0] * 1000 for outcome in outcomes)
+    statuses = {}
+    for _, _, _, status in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(outcomes),
+        'tickers_per_request': per_request,
+        'succeeded': sum(1 for outcome in outcomes if outcome[1]),
+        'failed': sum(1 for outcome in outcomes if not outcome[1]),
+        'status_codes': statuses,
+        'charts': sum(outcome[2] for outcome in outcomes),
+        'duration_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(outcomes) / elapsed, 3),
+        'charts_per_second': round(sum(outcome[2] for outcome in outcomes) / elapsed, 3),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 1),
+            'p95': round(percentile(latencies, 95), 1),
+            'p99': round(percentile(latencies, 99), 1),
+            'mean': round(sum(latencies) / len(latencies), 1),
+            'max': round(latencies[-1], 1),
+        },
+        'upstream_calls': upstream.stats()['calls'] - calls_before,
+        'peak_rss_mb': round(sampler.peak_kb / 1024, 1),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(SERVICE_SCRIPT)).stdout.strip()
+    except OSError:
+        return ''
+
+def compare(results: list, baseline_path: str, tolerance: float) -> bool:
+    """Print deltas against a saved baseline; False if anything regressed"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['scenario'], r['concurrency']): r for r in baseline.get('results', [])}
+
+    print(f"\n📊 Compared with {baseline_path} ({baseline.get('git_commit') or 'unknown commit'}, "
+          f"{baseline.get('config', {}).get('server', 'dev')} server)")
+    print(f"   {'scenario':<8} {'conc':>4} {'p95 ms':>18} {'rps':>16} {'peak MB':>16}")
+    regressed = False
+    for result in results:
+        old = previous.get((result['scenario'], result['concurrency']))
+        if old is None:
+            print(f"   {result['scenario']:<8} {result['concurrency']:>4}   (no baseline)")
+            continue
+        p95, old_p95 = result['latency_ms']['p95'], old['latency_ms']['p95']
+        rps, old_rps = result['requests_per_second'], old['requests_per_second']
+        worse = p95 > old_p95 * (1 + tolerance) or rps < old_rps * (1 - tolerance)
+        regressed = regressed or worse
+        print(f"   {result['scenario']:<8} {result['concurrency']:>4} "
+              f"{old_p95:>8.0f} -> {p95:<7.0f} {old_rps:>6.2f} -> {rps:<6.2f} "
+              f"{old['peak_rss_mb']:>6.1f} -> {result['peak_rss_mb']:<6.1f} {'❌' if worse else '✅'}")
+    return not regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Chart-IMG service against a fake upstream')
+    parser.add_argument('--scenarios', default='single,batch', help='Comma-separated: single, batch')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=32, help='Requests per scenario and level')
+    parser.add_argument('--batch-size', type=int, default=5, help='Tickers per batch request')
+    parser.add_argument('--response-mode', default='inline', choices=('inline', 'reference'))
+    parser.add_argument('--reuse-tickers', action='store_true',
+                        help='Reuse the same tickers so repeated requests hit the cache')
+    parser.add_argument('--timeout', type=float, default=300, help='Per-request timeout in seconds')
+    parser.add_argument('--server', default='dev', choices=('dev', 'gunicorn'),
+                        help="Flask's development server or gunicorn with gunicorn.conf.py")
+    parser.add_argument('--port', type=int, default=5098, help='Port for the benchmarked service')
+    parser.add_argument('--service-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment for the service, e.g. CHART_MAX_WORKERS=24')
+    parser.add_argument('--output', help='Write results JSON here (default: benchmarks/<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed p95/rps regression against the baseline (fraction)')
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    args.run_id = datetime.now().strftime('%H%M%S')
+
+    try:
+        scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+        levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+        extra_env = dict(item.split('=', 1) for item in args.service_env)
+        fake = fake_from_args(args)
+    except ValueError as e:
+        print(f"❌ Invalid arguments: {e}")
+        sys.exit(2)
+    unknown = set(scenarios) - {'single', 'batch'}
+    if unknown:
+        print(f"❌ Unknown scenarios: {', '.join(sorted(unknown))}")
+        sys.exit(2)
+
+    print("⏱️  Chart-IMG Service Benchmark")
+    print("=" * 60)
+
+    fake_server, upstream_url = start_server(fake)
+    print(f"Fake upstream: {upstream_url} (latency {args.latency}, {args.image_kb} KB images)")
+
+    workdir = tempfile.mkdtemp(prefix='chart-bench-')
+    process, base_url = start_service(args.server, args.port, upstream_url, workdir, extra_env)
+    sampler = RssSampler(process.pid).start()
+    print(f"Service: {base_url} ({args.server}, pid {process.pid}, workdir {workdir})")
+
+    results = []
+    try:
+        for scenario in scenarios:
+            for concurrency in levels:
+                result = run_level(base_url, scenario, concurrency, args, sampler, fake)
+                results.append(result)
+                latency = result['latency_ms']
+                print(f"  {scenario:<6} c={concurrency:<3} "
+                      f"p50 {latency['p50']:>7.0f} ms  p95 {latency['p95']:>7.0f} ms  p99 {latency['p99']:>7.0f} ms  "
+                      f"{result['requests_per_second']:>6.2f} req/s  "
+                      f"{result['failed']} failed  peak {result['peak_rss_mb']:.0f} MB")
+    finally:
+        sampler.stop()
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        fake_server.shutdown()
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'server': args.server,
+            'requests': args.requests,
+            'batch_size': args.batch_size,
+            'response_mode': args.response_mode,
+            'reuse_tickers': args.reuse_tickers,
+            'service_env': extra_env,
+        },
+        'upstream': fake.stats(),
+        'results': results,
+    }
+
+    output = args.output or os.path.join('benchmarks', f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        print("\n⚠️  Regression beyond tolerance")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
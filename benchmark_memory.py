@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for Chart-IMG Service
+Measures how much memory a /generate-charts request needs on top of what the
+service already holds: the Python heap peak per request (tracemalloc) and
+the process RSS growth while requests run concurrently. The service runs
+in-process behind Flask's test client, its body is consumed chunk by chunk
+the way a WSGI server writes it, and Chart-IMG is a fake_chart_img_server.py
+subprocess so upstream images are not counted.
+
+Usage:
+    python3 benchmark_memory.py
+    python3 benchmark_memory.py --image-kb 600 --requests 16 --concurrency 8
+    python3 benchmark_memory.py --scenarios batch --batch-size 10 --output benchmarks/memory.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmark_chart_service import BENCHMARK_SERVICE_ENV, SERVICE_DIR, git_commit, percentile
+from fake_chart_img_server import add_fake_arguments
+
+FAKE_SCRIPT = os.path.join(SERVICE_DIR, 'fake_chart_img_server.py')
+
+def rss_kb() -> int:
+    """Resident memory of this process only (the fake upstream is a child)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    # Without /proc only the lifetime peak is available (KB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+class PeakRss:
+    """Sample this process's RSS in the background and keep the maximum"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_kb = rss_kb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, rss_kb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def start_fake(args) -> tuple:
+    """Start the fake Chart-IMG server as a subprocess; returns (process, v2_url)"""
+    command = [sys.executable, '-u', FAKE_SCRIPT, '--port', '0', '--latency', args.latency,
+               '--image-kb', str(args.image_kb), '--error-rate', str(args.error_rate),
+               '--error-status', str(args.error_status), '--burst-every', str(args.burst_every),
+               '--burst-length', str(args.burst_length), '--reject-intervals', args.reject_intervals]
+    if args.retry_after:
+        command += ['--retry-after', args.retry_after]
+    # Its stderr only carries tracebacks for client connections reset at shutdown
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    if ' on ' not in line:
+        process.kill()
+        raise RuntimeError(f"Fake Chart-IMG did not start: {line.strip() or process.wait()}")
+    return process, line.split(' on ', 1)[1].strip()
+
+def load_service(upstream_url: str, workdir: str, extra_env: dict):
+    """Import the service configured like benchmark_chart_service.py configures its subprocess"""
+    os.environ.update(BENCHMARK_SERVICE_ENV)
+    os.environ.update({
+        'CHART_IMG_V2_URL': upstream_url,
+        'CHART_OUTPUT_DIR': os.path.join(workdir, 'charts'),
+    })
+    os.environ.update(extra_env)
+    os.chdir(workdir)  # chart_service.log goes next to the charts
+    sys.path.insert(0, SERVICE_DIR)
+    import chart_img_service_v7_hybrid as service
+    service.logger.setLevel('ERROR')
+    return service
+
+def make_request(scenario: str, prefix: str, i: int, args) -> tuple:
+    """(path, body) for one request; tickers are fresh so every chart is rendered"""
+    options = {'response_mode': args.response_mode}
+    if args.timeframes:
+        options['timeframes'] = args.timeframes
+    if scenario == 'batch':
+        return '/generate-charts/batch', {
+            'tickers': [f"{prefix}{i:04d}{j:02d}" for j in range(args.batch_size)], **options}
+    return '/generate-charts', {'ticker': f"{prefix}{i:04d}", **options}
+
+def send(client, path: str, body: dict) -> tuple:
+    """POST and drain the body chunk by chunk; returns (status, body bytes)"""
+    response = client.post(path, json=body, buffered=False)
+    size = 0
+    try:
+        for chunk in response.response:
+            size += len(chunk)
+    finally:
+        response.close()
+    return response.status_code, size
+
+def measure_sequential(service, scenario: str, args, prefix: str) -> dict:
+    """Heap peak above the pre-request baseline, one request at a time"""
+    client = service.app.test_client()
+    peaks, sizes, failed = [], [], 0
+    tracemalloc.start()
+    try:
+        for i in range(args.requests):
+            path, body = make_request(scenario, prefix, i, args)
+            service.chart_writer.flush(timeout=30)
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            status, size = send(client, path, body)
+            peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024 / 1024)
+            sizes.append(size)
+            failed += status != 200
+    finally:
+        tracemalloc.stop()
+    peaks.sort()
+    return {
+        'requests': len(peaks),
+        'failed': failed,
+        'response_mb': round(sum(sizes) / len(sizes) / 1024 / 1024, 2),
+        'heap_peak_mb': {
+            'p50': round(percentile(peaks, 50), 2),
+            'p95': round(percentile(peaks, 95), 2),
+            'max': round(peaks[-1], 2),
+        },
+    }
+
+def measure_concurrent(service, scenario: str, args, prefix: str) -> dict:
+    """RSS growth while args.concurrency requests run at once"""
+    local = threading.local()
+
+    def run(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = service.app.test_client()
+        return send(client, *make_request(scenario, prefix, i, args))
+
+    service.chart_writer.flush(timeout=30)
+    gc.collect()
+    before = rss_kb()
+    started = time.perf_counter()
+    with PeakRss() as sampler, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(run, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(outcomes),
+        'concurrency': args.concurrency,
+        'failed': sum(1 for status, _ in outcomes if status != 200),
+        'duration_seconds': round(elapsed, 3),
+        'rss_before_mb': round(before / 1024, 1),
+        'rss_peak_mb': round(sampler.peak_kb / 1024, 1),
+        'rss_growth_mb': round((sampler.peak_kb - before) / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-request memory benchmark for the Chart-IMG service')
+    parser.add_argument('--scenarios', default='single', help='Comma-separated: single, batch')
+    parser.add_argument('--requests', type=int, default=12, help='Requests per scenario and phase')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent requests in the RSS phase')
+    parser.add_argument('--batch-size', type=int, default=5, help='Tickers per batch request')
+    parser.add_argument('--timeframes', default='', help="Comma-separated timeframes (default: the profile's)")
+    parser.add_argument('--response-mode', default='inline', choices=('inline', 'reference'))
+    parser.add_argument('--service-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment for the service, e.g. CHART_CACHE_MAX_BYTES=0')
+    parser.add_argument('--output', help='Also write the report as JSON here')
+    add_fake_arguments(parser)
+    parser.set_defaults(latency='fixed:0.2', reject_intervals='')
+    args = parser.parse_args()
+    args.output = args.output and os.path.abspath(args.output)  # The service runs from a temp dir
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - {'single', 'batch'}
+    if unknown or args.requests < 1 or args.concurrency < 1:
+        print(f"❌ Invalid arguments: {', '.join(sorted(unknown)) or '--requests and --concurrency must be >= 1'}")
+        sys.exit(2)
+    try:
+        extra_env = dict(item.split('=', 1) for item in args.service_env)
+        fake, upstream_url = start_fake(args)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+
+    print("🧠 Chart-IMG Memory Benchmark")
+    print("=" * 60)
+    print(f"Fake upstream: {upstream_url} (latency {args.latency}, {args.image_kb} KB images)")
+    workdir = tempfile.mkdtemp(prefix='chart-memory-')
+    run_id = datetime.now().strftime('%H%M%S')
+    results = []
+    try:
+        service = load_service(upstream_url, workdir, extra_env)
+        print(f"Service: in-process, git {git_commit() or 'unknown'}, workdir {workdir}\n")
+        # Warm up connections, lazy imports and the metrics registry
+        send(service.app.test_client(), *make_request('single', f"W{run_id}X", 0, args))
+
+        for scenario in scenarios:
+            prefix = f"M{scenario[0].upper()}{run_id}"
+            concurrent = measure_concurrent(service, scenario, args, f"{prefix}C")
+            sequential = measure_sequential(service, scenario, args, f"{prefix}S")
+            results.append({'scenario': scenario, 'sequential': sequential, 'concurrent': concurrent})
+            heap = sequential['heap_peak_mb']
+            print(f"  {scenario:<6} response {sequential['response_mb']:.2f} MB  "
+                  f"heap peak/request p50 {heap['p50']:.2f} MB  max {heap['max']:.2f} MB")
+            print(f"  {'':<6} c={concurrent['concurrency']:<3} RSS {concurrent['rss_before_mb']:.0f} -> "
+                  f"{concurrent['rss_peak_mb']:.0f} MB (+{concurrent['rss_growth_mb']:.0f} MB)  "
+                  f"{sequential['failed'] + concurrent['failed']} failed")
+    finally:
+        fake.terminate()
+        try:
+            fake.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            fake.kill()
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'batch_size': args.batch_size,
+            'timeframes': args.timeframes,
+            'response_mode': args.response_mode,
+            'image_kb': args.image_kb,
+            'latency': args.latency,
+            'service_env': extra_env,
+        },
+        'results': results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
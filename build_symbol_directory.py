@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Build the symbol directory for Chart-IMG Service
+Downloads the NASDAQ Trader listing files (nasdaqlisted.txt / otherlisted.txt)
+and writes "TICKER,EXCHANGE" lines with TradingView exchange prefixes, which
+the service indexes at startup (CHART_SYMBOL_DIRECTORY).
+
+Usage:
+    python3 build_symbol_directory.py
+    python3 build_symbol_directory.py --input nasdaqlisted.txt --input otherlisted.txt --output symbol_directory.csv
+"""
+
+import argparse
+import os
+import re
+import sys
+from datetime import datetime
+
+import requests
+
+LISTING_URLS = [
+    'https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt',
+    'https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt',
+]
+
+# otherlisted.txt exchange codes -> TradingView exchange prefixes
+OTHER_EXCHANGES = {
+    'N': 'NYSE',    # New York Stock Exchange
+    'A': 'AMEX',    # NYSE American
+    'P': 'AMEX',    # NYSE Arca (TradingView lists Arca ETFs under AMEX)
+    'Z': 'CBOE',    # Cboe BZX
+    'V': 'IEX',     # Investors' Exchange
+}
+
+# Preferred shares, warrants with '$' / '=' etc. use other spellings on TradingView
+TICKER_PATTERN = re.compile(r'^[A-Z0-9]+(\.[A-Z0-9]+)?$')
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symbol_directory.csv')
+
+def parse_listing(text: str) -> dict:
+    """Parse one pipe-delimited NASDAQ Trader listing into {ticker: exchange}"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return {}
+    header = lines[0].split('|')
+    symbols = {}
+    for line in lines[1:]:
+        if line.startswith('File Creation Time'):
+            continue
+        row = dict(zip(header, line.split('|')))
+        if row.get('Test Issue') == 'Y':
+            continue
+
+        if 'Market Category' in row:
+            # nasdaqlisted.txt - every row trades on NASDAQ
+            ticker, exchange = row.get('Symbol', ''), 'NASDAQ'
+        else:
+            ticker = row.get('ACT Symbol') or row.get('CQS Symbol', '')
+            exchange = OTHER_EXCHANGES.get(row.get('Exchange', ''))
+
+        ticker = ticker.strip().upper()
+        if exchange and TICKER_PATTERN.match(ticker):
+            symbols[ticker] = exchange
+    return symbols
+
+def main():
+    parser = argparse.ArgumentParser(description='Build symbol_directory.csv from NASDAQ Trader listings')
+    parser.add_argument('--input', action='append', default=[],
+                        help='Local listing file(s) to use instead of downloading')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    print("📚 Building symbol directory")
+    print("=" * 60)
+
+    symbols = {}
+    sources = args.input or LISTING_URLS
+    for source in sources:
+        try:
+            if source.startswith('http'):
+                response = requests.get(source, timeout=30)
+                response.raise_for_status()
+                text = response.text
+            else:
+                with open(source, encoding='utf-8') as f:
+                    text = f.read()
+        except (requests.RequestException, OSError) as e:
+            print(f"❌ Could not read {source}: {e}")
+            sys.exit(1)
+        listed = parse_listing(text)
+        print(f"   ✅ {source}: {len(listed)} symbols")
+        symbols.update(listed)
+
+    if not symbols:
+        print("❌ No symbols found, leaving the existing directory untouched")
+        sys.exit(1)
+
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f"# Generated by build_symbol_directory.py on {datetime.now().isoformat()}\n")
+        f.write("symbol,exchange\n")
+        for ticker in sorted(symbols):
+            f.write(f"{ticker},{symbols[ticker]}\n")
+    os.replace(tmp_path, args.output)
+
+    by_exchange = {}
+    for exchange in symbols.values():
+        by_exchange[exchange] = by_exchange.get(exchange, 0) + 1
+    print(f"\n💾 Wrote {len(symbols)} symbols to {args.output}")
+    for exchange, count in sorted(by_exchange.items()):
+        print(f"   {exchange}: {count}")
+    print("\nRestart the service to load the new directory.")
+
+if __name__ == "__main__":
+    main()
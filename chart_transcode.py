@@ -0,0 +1,37 @@
+"""
+Chart image transcoding for the Chart-IMG service
+Runs in the service's transcode process pool. It lives apart from the
+service so pool processes import only Pillow, not the Flask app with its
+connections and background threads.
+"""
+
+import os
+from typing import Optional
+
+# Pillow is optional - the service checks PIL_AVAILABLE before transcoding
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def transcode_image(src_path: str, dest_path: str, image_format: str,
+                    max_width: Optional[int], quality: int) -> int:
+    """Re-encode a chart PNG (runs in the transcode process pool); returns bytes written"""
+    with Image.open(src_path) as image:
+        image.load()
+        if max_width and image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            image = image.resize((max_width, height), Image.LANCZOS)
+        if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        save_args = {'optimize': True}
+        if image_format in ('jpeg', 'webp'):
+            save_args['quality'] = quality
+        if image_format == 'webp':
+            save_args['method'] = 4
+
+        tmp_path = f"{dest_path}.tmp-{os.getpid()}"
+        image.save(tmp_path, format=image_format.upper(), **save_args)
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Fake Chart-IMG v2 server for benchmarks
+Stands in for CHART_IMG_V2_URL with configurable latency, errors, 429 bursts
+and image sizes, so throughput can be measured without spending API quota.
+
+Usage:
+    python3 fake_chart_img_server.py --port 5099 --latency lognormal:2.5,0.4 --error-rate 0.02
+    CHART_IMG_V2_URL=http://127.0.0.1:5099/v2/tradingview/advanced-chart python3 chart_img_service_v7_hybrid.py
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+V2_PATH = '/v2/tradingview/advanced-chart'
+
+def parse_latency(spec: str):
+    """Parse a latency spec into a sampler returning seconds
+
+    Supported: fixed:S, uniform:MIN,MAX, lognormal:MEDIAN,SIGMA
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v]
+    if kind == 'fixed' and len(values) == 1:
+        return lambda: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal' and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Invalid latency spec {spec!r} (use fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA)")
+
+def make_png(seed: str, size_bytes: int) -> bytes:
+    """Build a valid PNG of roughly size_bytes, deterministic per seed
+
+    The pixel data is pseudo-random so it does not compress away, which keeps
+    the body size close to the requested one.
+    """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    width = 256
+    row_bytes = width * 3
+    rows = max(1, size_bytes // (row_bytes + 1))
+    rng = random.Random(hashlib.sha256(seed.encode()).digest())
+    raw = b''.join(b'\x00' + rng.randbytes(row_bytes) for _ in range(rows))
+    header = struct.pack('>IIBBBBB', width, rows, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b''))
+
+class FakeChartImg:
+    """Behaviour and counters shared by all request handlers"""
+
+    def __init__(self, latency: str = 'fixed:0.5', error_rate: float = 0.0, error_status: int = 500,
+                 burst_every: int = 0, burst_length: int = 0, retry_after: Optional[str] = None,
+                 image_kb: int = 300, reject_intervals: str = ''):
+        self.latency_spec = latency
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.image_bytes = image_kb * 1024
+        self.reject_intervals = {i for i in reject_intervals.split(',') if i}
+        self._lock = threading.Lock()
+        self._images = {}
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.status_codes = {}
+
+    def image_for(self, symbol: str, interval: str) -> bytes:
+        key = f"{symbol}|{interval}"
+        with self._lock:
+            image = self._images.get(key)
+        if image is None:
+            image = make_png(key, self.image_bytes)
+            with self._lock:
+                self._images[key] = image
+        return image
+
+    def respond(self, payload: dict):
+        """Return (status, headers, body) for one chart request"""
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(max(0.0, self.sample_latency()))
+
+            if self.burst_every and (call - 1) % self.burst_every < self.burst_length:
+                headers = {'Retry-After': self.retry_after} if self.retry_after else {}
+                result = 429, headers, b'{"message":"Too Many Requests"}'
+            elif payload.get('interval') in self.reject_intervals:
+                result = 422, {}, b'{"message":"Invalid interval"}'
+            elif self.error_rate and random.random() < self.error_rate:
+                result = self.error_status, {}, b'{"message":"Injected error"}'
+            else:
+                body = self.image_for(str(payload.get('symbol')), str(payload.get('interval')))
+                result = 200, {'Content-Type': 'image/png'}, body
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        with self._lock:
+            self.status_codes[str(result[0])] = self.status_codes.get(str(result[0]), 0) + 1
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'status_codes': dict(self.status_codes),
+                'latency': self.latency_spec,
+                'image_bytes': self.image_bytes,
+            }
+
+def make_handler(fake: FakeChartImg):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, headers: dict, body: bytes):
+            self.send_response(status)
+            headers = {'Content-Type': 'application/json', **headers}
+            for name, value in headers.items():
+                self.send_header(name, str(value))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/__stats':
+                self._send(200, {}, json.dumps(fake.stats()).encode())
+            else:
+                self._send(404, {}, b'{"message":"Not found"}')
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._send(400, {}, b'{"message":"Invalid JSON"}')
+                return
+            if self.path != V2_PATH:
+                self._send(404, {}, b'{"message":"Not found"}')
+                return
+            self._send(*fake.respond(payload))
+
+    return Handler
+
+def start_server(fake: FakeChartImg, host: str = '127.0.0.1', port: int = 0):
+    """Start the fake in a daemon thread; returns (server, v2_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{V2_PATH}"
+
+def add_fake_arguments(parser: argparse.ArgumentParser):
+    """Options shared with benchmark_chart_service.py"""
+    parser.add_argument('--latency', default='lognormal:1.0,0.5',
+                        help='fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls failing with --error-status')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--burst-every', type=int, default=0, help='Start a 429 burst every N calls (0 = never)')
+    parser.add_argument('--burst-length', type=int, default=0, help='Calls answered with 429 in each burst')
+    parser.add_argument('--retry-after', default=None, help='Retry-After header sent with 429s')
+    parser.add_argument('--image-kb', type=int, default=300, help='Approximate PNG size returned')
+    parser.add_argument('--reject-intervals', default='1h',
+                        help="Comma-separated intervals answered with 422 (the real API rejects '1h')")
+
+def fake_from_args(args) -> FakeChartImg:
+    return FakeChartImg(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        burst_every=args.burst_every,
+        burst_length=args.burst_length,
+        retry_after=args.retry_after,
+        image_kb=args.image_kb,
+        reject_intervals=args.reject_intervals,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Chart-IMG v2 server for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5099)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        fake = fake_from_args(args)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+
+    server, url = start_server(fake, args.host, args.port)
+    print(f"🧪 Fake Chart-IMG listening on {url}")
+    print(f"   Stats: http://{args.host}:{server.server_address[1]}/__stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
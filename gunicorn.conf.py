@@ -0,0 +1,45 @@
+"""
+Gunicorn configuration for Chart-IMG Service
+Production entry point replacing Flask's development server:
+
+    gunicorn -c gunicorn.conf.py chart_img_service_v7_hybrid:app
+
+Requests spend almost all their time waiting on Chart-IMG, so the default is
+one process with many threads (gthread). That keeps the chart cache, request
+coalescing, async jobs and metrics in a single process. Extra workers add CPU
+for transcoding and JSON encoding. Each one has its own in-memory cache and
+job list and gets an equal share of the upstream quota; the shared cache
+(on automatically with more than one worker) still renders each chart only
+once per host.
+"""
+
+import os
+
+bind = os.environ.get('CHART_BIND', f"0.0.0.0:{os.environ.get('CHART_SERVICE_PORT', 5002)}")
+worker_class = 'gthread'
+workers = int(os.environ.get('CHART_GUNICORN_WORKERS', 1))
+threads = int(os.environ.get('CHART_GUNICORN_THREADS', 32))
+
+# A full ticker (or a batch) can wait on upstream retries and the rate limiter
+timeout = int(os.environ.get('CHART_GUNICORN_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('CHART_GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = int(os.environ.get('CHART_GUNICORN_KEEPALIVE', 5))
+backlog = int(os.environ.get('CHART_GUNICORN_BACKLOG', 2048))
+
+# The service starts its writer, sweeper and pool threads at import time;
+# threads do not survive fork, so every worker must import the app itself
+preload_app = False
+
+# The service logs to chart_service.log; access logs only when asked for
+accesslog = os.environ.get('CHART_GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('CHART_GUNICORN_LOG_LEVEL', 'info')
+
+def post_fork(server, worker):
+    """Tell every worker how many processes share the Chart-IMG quota
+
+    Runs in the worker before it imports the app. server.num_workers is the
+    final count - -w/--workers on the command line, or TTIN/TTOU since -
+    which the workers setting above may not be.
+    """
+    os.environ['CHART_WORKER_PROCESSES'] = str(server.num_workers)
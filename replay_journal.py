@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Request journal replay for Chart-IMG Service
+Replays the /generate-charts and /test calls recorded in the service's
+request journal (CHART_JOURNAL_FILE) with their original spacing, sped up
+or slowed down, and reports latency percentiles and error rates next to the
+ones recorded in production.
+
+Without --target a fake Chart-IMG server and a local service are started,
+exactly as benchmark_chart_service.py does, so no API quota is spent.
+
+Usage:
+    python3 replay_journal.py ~/chart-img-outputs/request_journal.jsonl
+    python3 replay_journal.py request_journal.jsonl.1 request_journal.jsonl --speed 10
+    python3 replay_journal.py request_journal.jsonl --target http://localhost:5002 --speed 1
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+import requests
+
+from benchmark_chart_service import percentile, start_service
+from fake_chart_img_server import add_fake_arguments, fake_from_args, start_server
+
+ENDPOINTS = ('generate-charts', 'test')
+
+def load_journal(paths, endpoints) -> tuple:
+    """Journal entries from all files, oldest first; returns (entries, skipped lines)"""
+    entries, skipped = [], 0
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    float(entry['ts'])
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+                    continue
+                if entry.get('endpoint') in endpoints and entry.get('ticker'):
+                    entries.append(entry)
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries, skipped
+
+def build_request(entry: dict) -> tuple:
+    """(method, path, json body) reproducing one journaled request
+
+    Async requests are replayed synchronously, so their latency covers the
+    renders rather than just the job submission.
+    """
+    if entry['endpoint'] == 'test':
+        params = [f"profile={quote(entry['profile'])}"] if entry.get('profile') else []
+        if entry.get('refresh'):
+            params.append('refresh=1')
+        query = f"?{'&'.join(params)}" if params else ''
+        return 'GET', f"/test/{quote(entry['ticker'])}{query}", None
+
+    body = {'ticker': entry['ticker']}
+    for field in ('profile', 'timeframes', 'response_mode', 'priority', 'deadline'):
+        if entry.get(field):
+            body[field] = entry[field]
+    body.update(entry.get('variant') or {})
+    return 'POST', '/generate-charts', body
+
+def summarize(outcomes: list) -> dict:
+    """Replayed vs recorded latency and error rate for a group of requests"""
+    replayed = sorted(outcome['ms'] for outcome in outcomes)
+    recorded = sorted(outcome['recorded_ms'] for outcome in outcomes if outcome['recorded_ms'] is not None)
+    statuses = {}
+    for outcome in outcomes:
+        statuses[str(outcome['status'])] = statuses.get(str(outcome['status']), 0) + 1
+    failed = sum(1 for outcome in outcomes if not outcome['ok'])
+    recorded_failed = sum(1 for outcome in outcomes if outcome['recorded_status'] not in (200, 202))
+
+    def latency(values):
+        if not values:
+            return None
+        return {
+            'p50': round(percentile(values, 50), 1),
+            'p95': round(percentile(values, 95), 1),
+            'p99': round(percentile(values, 99), 1),
+            'max': round(values[-1], 1),
+        }
+
+    return {
+        'requests': len(outcomes),
+        'failed': failed,
+        'error_rate': round(failed / len(outcomes), 4) if outcomes else 0.0,
+        'recorded_error_rate': round(recorded_failed / len(outcomes), 4) if outcomes else 0.0,
+        'charts_failed': sum(outcome['charts_failed'] for outcome in outcomes),
+        'status_codes': statuses,
+        'latency_ms': latency(replayed),
+        'recorded_latency_ms': latency(recorded),
+    }
+
+def replay(entries: list, base_url: str, speed: float, max_in_flight: int, timeout: float) -> tuple:
+    """Send every entry at its (scaled) original offset; returns (outcomes, seconds)"""
+    local = threading.local()
+    first_ts = entries[0]['ts']
+
+    def send(entry, due):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        method, path, body = build_request(entry)
+        started = time.perf_counter()
+        lag = max(0.0, started - due)
+        charts_failed = 0
+        try:
+            response = session.request(method, f'{base_url}{path}', json=body, timeout=timeout)
+            status = response.status_code
+            ok = status == 200
+            if ok and entry['endpoint'] == 'generate-charts':
+                data = response.json()
+                ok = bool(data.get('success'))
+                charts_failed = data.get('error_count', 0)
+        except (requests.RequestException, ValueError) as e:
+            ok, status = False, type(e).__name__
+        return {
+            'endpoint': entry['endpoint'],
+            'ms': (time.perf_counter() - started) * 1000,
+            'status': status,
+            'ok': ok,
+            'charts_failed': charts_failed,
+            'lag_ms': lag * 1000,
+            'recorded_ms': entry.get('ms'),
+            'recorded_status': entry.get('status'),
+        }
+
+    futures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for entry in entries:
+            due = started + ((entry['ts'] - first_ts) / speed if speed > 0 else 0.0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, entry, due))
+        outcomes = [future.result() for future in futures]
+    return outcomes, time.perf_counter() - started
+
+def print_group(name: str, summary: dict):
+    latency, recorded = summary['latency_ms'], summary['recorded_latency_ms']
+    line = (f"  {name:<16} {summary['requests']:>5} req  "
+            f"errors {summary['error_rate'] * 100:>5.1f}% (recorded {summary['recorded_error_rate'] * 100:.1f}%)")
+    print(line)
+    if latency:
+        print(f"  {'':<16} replayed  p50 {latency['p50']:>7.0f}  p95 {latency['p95']:>7.0f}  "
+              f"p99 {latency['p99']:>7.0f}  max {latency['max']:>7.0f} ms")
+    if recorded:
+        print(f"  {'':<16} recorded  p50 {recorded['p50']:>7.0f}  p95 {recorded['p95']:>7.0f}  "
+              f"p99 {recorded['p99']:>7.0f}  max {recorded['max']:>7.0f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a Chart-IMG service request journal')
+    parser.add_argument('journal', nargs='+', help='Journal file(s), e.g. request_journal.jsonl.1 request_journal.jsonl')
+    parser.add_argument('--target', help='Base URL of the instance to replay against '
+                                         '(default: start a local service backed by a fake upstream)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed: 1 = original pacing, 10 = ten times faster, 0 = as fast as possible')
+    parser.add_argument('--limit', type=int, default=0, help='Replay only the first N entries')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated: generate-charts, test')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Cap on concurrent replayed requests')
+    parser.add_argument('--timeout', type=float, default=300, help='Per-request timeout in seconds')
+    parser.add_argument('--server', default='dev', choices=('dev', 'gunicorn'),
+                        help='Server for the local service (without --target)')
+    parser.add_argument('--port', type=int, default=5097, help='Port for the local service (without --target)')
+    parser.add_argument('--service-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment for the local service, e.g. CHART_MAX_WORKERS=24')
+    parser.add_argument('--output', help='Also write the report as JSON here')
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+
+    endpoints = {e.strip() for e in args.endpoints.split(',') if e.strip()}
+    unknown = endpoints - set(ENDPOINTS)
+    if unknown or args.speed < 0:
+        print(f"❌ Invalid arguments: {', '.join(sorted(unknown)) or '--speed must be >= 0'}")
+        sys.exit(2)
+    try:
+        entries, skipped = load_journal(args.journal, endpoints)
+        extra_env = dict(item.split('=', 1) for item in args.service_env)
+        fake = None if args.target else fake_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("❌ No replayable journal entries found")
+        sys.exit(1)
+
+    span = entries[-1]['ts'] - entries[0]['ts']
+    print("🔁 Chart-IMG Journal Replay")
+    print("=" * 60)
+    print(f"Journal: {len(entries)} requests over {span:.0f}s "
+          f"({datetime.fromtimestamp(entries[0]['ts']).isoformat(timespec='seconds')} onwards)"
+          + (f", {skipped} unreadable lines skipped" if skipped else ''))
+
+    process = fake_server = None
+    if args.target:
+        base_url = args.target.rstrip('/')
+    else:
+        fake_server, upstream_url = start_server(fake)
+        print(f"Fake upstream: {upstream_url} (latency {args.latency}, {args.image_kb} KB images)")
+        workdir = tempfile.mkdtemp(prefix='chart-replay-')
+        process, base_url = start_service(args.server, args.port, upstream_url, workdir, extra_env)
+        print(f"Service: {base_url} ({args.server}, pid {process.pid}, workdir {workdir})")
+    speed = f"{args.speed:g}x" if args.speed > 0 else 'as fast as possible'
+    print(f"Replaying against {base_url} at {speed}...\n")
+
+    try:
+        outcomes, elapsed = replay(entries, base_url, args.speed, args.max_in_flight, args.timeout)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fake_server is not None:
+            fake_server.shutdown()
+
+    lags = sorted(outcome['lag_ms'] for outcome in outcomes)
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'target': base_url,
+        'journal': args.journal,
+        'speed': args.speed,
+        'journal_span_seconds': round(span, 3),
+        'replay_seconds': round(elapsed, 3),
+        'schedule_lag_ms': {'p95': round(percentile(lags, 95), 1), 'max': round(lags[-1], 1)},
+        'overall': summarize(outcomes),
+        'endpoints': {
+            endpoint: summarize([o for o in outcomes if o['endpoint'] == endpoint])
+            for endpoint in sorted({o['endpoint'] for o in outcomes})
+        },
+    }
+    if fake is not None:
+        report['upstream'] = fake.stats()
+
+    print_group('all', report['overall'])
+    for endpoint, summary in report['endpoints'].items():
+        print_group(endpoint, summary)
+    print(f"\n⏱️  Replayed {span:.0f}s of traffic in {elapsed:.1f}s; "
+          f"schedule lag p95 {report['schedule_lag_ms']['p95']:.0f} ms, max {report['schedule_lag_ms']['max']:.0f} ms")
+    if report['schedule_lag_ms']['p95'] > 1000:
+        print("⚠️  Requests started late - raise --max-in-flight or lower --speed")
+    if fake is not None:
+        print(f"🧪 Fake upstream calls: {report['upstream']['calls']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,11 @@ mkdir -p /Users/abdulaziznahas/chart-img-outputs
 echo "Checking for existing service on port 5002..."
 lsof -ti:5002 | xargs kill -9 2>/dev/null
 
-# Start the service
-echo "Starting Chart-IMG Service v7.0 (Hybrid Production)..."
-python3 chart_img_service_v7_hybrid.py
+# Start the service - gunicorn by default, CHART_SERVER=dev for Flask's dev server
+if [ "${CHART_SERVER:-gunicorn}" = "dev" ]; then
+    echo "Starting Chart-IMG Service v7.0 (Flask development server)..."
+    python3 chart_img_service_v7_hybrid.py
+else
+    echo "Starting Chart-IMG Service v7.0 (gunicorn, ${CHART_GUNICORN_WORKERS:-1} worker(s) x ${CHART_GUNICORN_THREADS:-32} threads)..."
+    exec gunicorn -c gunicorn.conf.py chart_img_service_v7_hybrid:app
+fi
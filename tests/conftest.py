@@ -0,0 +1,38 @@
+"""
+Shared setup for the Chart-IMG service unit tests
+The service configures itself from the environment at import, so it is
+imported once here against a throwaway output directory and an upstream
+that refuses connections. Tests build their own instances of the classes
+under test rather than using the module's singletons.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix='chart-img-tests-')
+
+os.environ.update({
+    'CHART_OUTPUT_DIR': os.path.join(WORK_DIR, 'charts'),
+    'CHART_IMG_V2_URL': 'http://127.0.0.1:1/v2/tradingview/advanced-chart',
+    'CHART_MARKET_TIMEZONE': 'America/New_York',
+    'CHART_SESSION_CLOSE': '16:00',
+    'CHART_WATCHLIST': '',
+    'CHART_SHARED_CACHE': '0',
+})
+sys.path.insert(0, SERVICE_DIR)
+
+# The service logs to chart_service.log in the working directory
+_cwd = os.getcwd()
+os.chdir(WORK_DIR)
+try:
+    import chart_img_service_v7_hybrid
+finally:
+    os.chdir(_cwd)
+
+@pytest.fixture
+def service():
+    return chart_img_service_v7_hybrid
@@ -0,0 +1,141 @@
+"""Admission control decisions and the deadline request parameter"""
+
+import threading
+import time
+
+import pytest
+
+DEFAULT_LATENCY = 5.0
+
+@pytest.fixture
+def admission(service, monkeypatch):
+    """A controller (4 render slots, 12 renders in flight) over idle, private subsystems"""
+    monkeypatch.setattr(service, 'upstream_latency', service.LatencyTracker(
+        window=50, min_samples=1, default_timeout=30, min_timeout=1, max_timeout=60, multiplier=2))
+    monkeypatch.setattr(service, 'chart_executor', service.RenderPool(1, 'test-render'))
+    monkeypatch.setattr(service, 'upstream_rate_limiter', service.UpstreamRateLimiter(
+        rate_per_second=100, burst=100, daily_budget=1000, max_wait=5))
+    return service.AdmissionController(enabled=True, workers=4, max_in_flight=12,
+                                       default_latency=DEFAULT_LATENCY, retry_after_max=30)
+
+def test_idle_instance_admits_a_request_that_meets_its_deadline(admission):
+    decision = admission.admit('test', ['1h', '1D', '1W'], deadline=30)
+    
+    assert decision['reason'] is None
+    assert decision['estimated_seconds'] == DEFAULT_LATENCY
+    assert admission.stats()['reserved'] == 3
+
+def test_request_that_cannot_meet_its_deadline_is_shed(admission):
+    decision = admission.admit('test', ['1D'], deadline=3.5)
+    
+    assert decision['reason'] == 'deadline'
+    assert decision['retry_after'] == 2
+    assert admission.stats()['reserved'] == 0
+    assert admission.stats()['rejected'] == {'deadline': 1}
+
+def test_estimate_uses_the_slowest_intervals_p90(service, admission):
+    for seconds in (1.0, 1.0, 1.0, 9.0):
+        service.upstream_latency.record('1h', 0.5)
+        service.upstream_latency.record('1W', seconds)
+    
+    decision = admission.admit('test', ['1h', '1W'], deadline=30)
+    assert decision['estimated_seconds'] == 9.0
+
+def test_backlog_beyond_the_free_slots_adds_queue_time(admission):
+    admission.admit('test', ['1D'] * 6, deadline=60)
+    
+    # 6 reserved + 2 new renders over 4 slots: 4 queue ahead at the median latency
+    decision = admission.admit('test', ['1h', '1D'], deadline=60)
+    assert decision['backlog'] == 6
+    assert decision['estimated_seconds'] == 4 / 4 * DEFAULT_LATENCY + DEFAULT_LATENCY
+
+def test_rate_limiter_queue_counts_when_it_is_the_longer_wait(service, admission, monkeypatch):
+    monkeypatch.setattr(service, 'upstream_rate_limiter', service.UpstreamRateLimiter(
+        rate_per_second=0.1, burst=1, daily_budget=1000, max_wait=5))
+    
+    decision = admission.admit('test', ['1h', '1D', '1W'], deadline=10)
+    assert decision['reason'] == 'deadline'
+    assert decision['estimated_seconds'] == pytest.approx(2 / 0.1 + DEFAULT_LATENCY, abs=0.1)
+
+def test_request_pushing_the_backlog_past_max_in_flight_is_shed(admission):
+    admission.admit('test', ['1D'] * 10, deadline=60)
+    
+    decision = admission.admit('test', ['1h', '1D', '1W'], deadline=60)
+    assert decision['reason'] == 'saturated'
+    # One render over the limit drains through 4 slots at the median latency
+    assert decision['retry_after'] == 2
+    assert admission.stats()['reserved'] == 10
+
+def test_idle_instance_admits_any_size_that_meets_its_deadline(admission):
+    decision = admission.admit('test', ['1D'] * 20, deadline=30)
+    
+    assert decision['reason'] is None
+    assert decision['estimated_seconds'] == 16 / 4 * DEFAULT_LATENCY + DEFAULT_LATENCY
+
+def test_retry_after_is_capped(admission):
+    decision = admission.admit('test', ['1D'] * 100, deadline=1)
+    assert decision['retry_after'] == 30
+
+def test_released_reservations_free_the_backlog(admission):
+    first = admission.admit('test', ['1D'] * 10, deadline=60)
+    assert admission.admit('test', ['1D'] * 3, deadline=60)['reason'] == 'saturated'
+    
+    admission.release(first)
+    assert admission.admit('test', ['1D'] * 3, deadline=60)['reason'] is None
+
+def test_render_pool_backlog_counts_when_larger_than_reservations(service, admission):
+    release = threading.Event()
+    futures = [service.chart_executor.submit('bulk', release.wait, 5) for _ in range(3)]
+    try:
+        while service.chart_executor.running() == 0:
+            time.sleep(0.001)
+        assert admission.stats()['backlog'] == 3
+    finally:
+        release.set()
+        for future in futures:
+            future.result(5)
+
+def test_cached_requests_are_always_admitted(admission):
+    admission.admit('test', ['1D'] * 12, deadline=60)
+    
+    decision = admission.admit('test', [], deadline=0.001)
+    assert decision['reason'] is None
+    assert decision['estimated_seconds'] == 0
+
+def test_disabled_controller_admits_everything(admission):
+    admission.enabled = False
+    
+    decision = admission.admit('test', ['1D'] * 3, deadline=1)
+    assert decision['reason'] is None
+    assert admission.stats()['reserved'] == 3
+    assert admission.stats()['rejected'] == {}
+
+@pytest.mark.parametrize('body, query, expected', [
+    ({}, '', None),
+    ({'deadline': ''}, '', None),
+    ({'deadline': 12}, '', 12.0),
+    ({'deadline': '7.5'}, '', 7.5),
+    ({}, '?deadline=20', 20.0),
+    ({'deadline': 3}, '?deadline=20', 3.0),
+])
+def test_deadline_parameter(service, body, query, expected):
+    with service.app.test_request_context('/generate-charts' + query):
+        deadline = service.parse_deadline(body)
+    assert deadline == (service.CHART_REQUEST_DEADLINE if expected is None else expected)
+
+@pytest.mark.parametrize('value', [0, '0', -3, 'abc', True, 'nan', 'inf', [5]])
+def test_invalid_deadline_is_refused(service, value):
+    with service.app.test_request_context('/generate-charts'):
+        with pytest.raises(ValueError, match='deadline must be'):
+            service.parse_deadline({'deadline': value})
+
+@pytest.mark.parametrize('path, body', [
+    ('/generate-charts', {'ticker': 'AAPL', 'deadline': 0}),
+    ('/generate-charts?deadline=abc', {'ticker': 'AAPL'}),
+    ('/generate-charts/batch', {'tickers': ['AAPL'], 'deadline': -1}),
+])
+def test_endpoints_answer_400_for_an_invalid_deadline(service, path, body):
+    response = service.app.test_client().post(path, json=body)
+    
+    assert response.status_code == 400
+    assert 'deadline must be' in response.get_json()['error']
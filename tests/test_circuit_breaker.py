@@ -0,0 +1,110 @@
+"""Circuit breaker state changes: closed -> open -> half-open -> closed/open"""
+
+import time
+
+import pytest
+
+OPEN_SECONDS = 0.05
+
+def make_breaker(service, window=10, min_calls=4, error_rate=0.5, consecutive_failures=3):
+    return service.CircuitBreaker(window, min_calls, error_rate, consecutive_failures, OPEN_SECONDS)
+
+def call(breaker, success):
+    probe = breaker.before_call()
+    breaker.record(success, probe=probe)
+    return probe
+
+def trip(service, breaker):
+    for _ in range(3):
+        call(breaker, False)
+    assert breaker.state == service.CircuitBreaker.OPEN
+
+def test_consecutive_failures_open_the_breaker(service):
+    breaker = make_breaker(service)
+    call(breaker, False)
+    call(breaker, False)
+    assert breaker.state == service.CircuitBreaker.CLOSED
+    
+    call(breaker, False)
+    assert breaker.state == service.CircuitBreaker.OPEN
+    assert breaker.stats()['opened'] == 1
+
+def test_a_success_resets_the_consecutive_count(service):
+    breaker = make_breaker(service, min_calls=100)
+    for success in (False, False, True, False, False, True):
+        call(breaker, success)
+    assert breaker.state == service.CircuitBreaker.CLOSED
+    assert breaker.stats()['recent_failures'] == 4
+
+def test_failure_rate_opens_the_breaker_once_min_calls_are_seen(service):
+    breaker = make_breaker(service, consecutive_failures=100)
+    for success in (False, True, False):
+        call(breaker, success)
+    assert breaker.state == service.CircuitBreaker.CLOSED  # 2/3 failed, but only 3 calls
+    
+    call(breaker, True)
+    assert breaker.state == service.CircuitBreaker.OPEN  # 2/4 reaches error_rate
+
+def test_calls_without_a_verdict_are_not_counted(service):
+    breaker = make_breaker(service)
+    for _ in range(5):
+        call(breaker, None)
+    assert breaker.stats()['recent_calls'] == 0
+    assert breaker.state == service.CircuitBreaker.CLOSED
+
+def test_open_breaker_fails_calls_fast(service):
+    breaker = make_breaker(service)
+    trip(service, breaker)
+    
+    with pytest.raises(service.CircuitOpenError) as raised:
+        breaker.before_call()
+    assert 0 < raised.value.retry_in <= OPEN_SECONDS
+    assert breaker.stats()['short_circuited'] == 1
+
+def test_one_probe_is_admitted_after_open_seconds(service):
+    breaker = make_breaker(service)
+    trip(service, breaker)
+    time.sleep(OPEN_SECONDS)
+    
+    assert breaker.before_call() is True
+    assert breaker.state == service.CircuitBreaker.HALF_OPEN
+    with pytest.raises(service.CircuitOpenError):
+        breaker.before_call()
+
+def test_successful_probe_closes_the_breaker(service):
+    breaker = make_breaker(service)
+    trip(service, breaker)
+    time.sleep(OPEN_SECONDS)
+    
+    assert call(breaker, True) is True
+    assert breaker.state == service.CircuitBreaker.CLOSED
+    assert breaker.before_call() is False
+    assert breaker.stats()['recent_calls'] == 0
+
+def test_failed_probe_reopens_the_breaker(service):
+    breaker = make_breaker(service)
+    trip(service, breaker)
+    time.sleep(OPEN_SECONDS)
+    
+    call(breaker, False)
+    assert breaker.state == service.CircuitBreaker.OPEN
+    assert breaker.stats()['opened'] == 2
+    with pytest.raises(service.CircuitOpenError):
+        breaker.before_call()
+
+def test_probe_without_a_verdict_lets_another_probe_through(service):
+    breaker = make_breaker(service)
+    trip(service, breaker)
+    time.sleep(OPEN_SECONDS)
+    
+    call(breaker, None)
+    assert breaker.state == service.CircuitBreaker.HALF_OPEN
+    assert breaker.before_call() is True
+
+def test_outcomes_of_calls_admitted_before_opening_are_ignored(service):
+    breaker = make_breaker(service)
+    late = breaker.before_call()
+    trip(service, breaker)
+    
+    breaker.record(True, probe=late)
+    assert breaker.state == service.CircuitBreaker.OPEN
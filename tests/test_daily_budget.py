@@ -0,0 +1,77 @@
+"""The daily Chart-IMG budget is counted host-wide and survives restarts"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+TODAY = datetime.now(timezone.utc).date()
+
+@pytest.fixture
+def usage_db(tmp_path):
+    return str(tmp_path / 'usage.sqlite3')
+
+def test_take_counts_up_to_the_limit(service, usage_db):
+    usage = service.DailyUsage(usage_db)
+    
+    assert [usage.take('upstream', TODAY, 3) for _ in range(4)] == [1, 2, 3, None]
+    assert usage.used('upstream', TODAY) == 3
+
+def test_counts_are_per_name_and_day(service, usage_db):
+    usage = service.DailyUsage(usage_db)
+    usage.take('upstream', TODAY)
+    
+    assert usage.used('prewarm', TODAY) == 0
+    assert usage.used('upstream', TODAY + timedelta(days=1)) == 0
+
+def test_counts_survive_a_new_connection(service, usage_db):
+    service.DailyUsage(usage_db).take('upstream', TODAY)
+    service.DailyUsage(usage_db).take('upstream', TODAY - timedelta(days=8))
+    
+    usage = service.DailyUsage(usage_db)
+    assert usage.used('upstream', TODAY) == 1
+    assert usage.used('upstream', TODAY - timedelta(days=8)) == 0  # older than a week
+
+def test_concurrent_processes_never_overspend_the_limit(service, usage_db):
+    workers = [service.DailyUsage(usage_db) for _ in range(4)]
+    taken = []
+    
+    def spend(usage):
+        while usage.take('upstream', TODAY, 50) is not None:
+            taken.append(1)
+    
+    threads = [threading.Thread(target=spend, args=(usage,)) for usage in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    
+    assert len(taken) == 50
+    assert workers[0].used('upstream', TODAY) == 50
+
+def test_restarted_limiter_resumes_the_days_usage(service, usage_db):
+    make = lambda: service.UpstreamRateLimiter(rate_per_second=100, burst=10, daily_budget=3, max_wait=1,
+                                               usage=service.DailyUsage(usage_db))
+    limiter = make()
+    limiter.acquire()
+    limiter.acquire()
+    
+    restarted = make()
+    assert restarted.remaining_today() == 1
+    restarted.acquire()
+    with pytest.raises(service.RateLimitExceeded, match='budget'):
+        restarted.acquire()
+
+def test_limiters_in_several_workers_share_one_budget(service, usage_db):
+    limiters = [service.UpstreamRateLimiter(rate_per_second=100, burst=10, daily_budget=4, max_wait=1,
+                                            usage=service.DailyUsage(usage_db)) for _ in range(2)]
+    limiters[0].acquire()
+    limiters[1].acquire()
+    limiters[1].acquire()
+    
+    assert limiters[0].remaining_today() == 1
+    assert limiters[0].stats()['used_today'] == 3
+    limiters[0].acquire()
+    with pytest.raises(service.RateLimitExceeded):
+        limiters[1].acquire()
+    assert limiters[1].stats()['queue_depth'] == 0
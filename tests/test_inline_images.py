@@ -0,0 +1,48 @@
+"""Streamed inline images survive the store evicting their PNG mid-response"""
+
+import base64
+import json
+import os
+
+import pytest
+
+@pytest.fixture
+def png(tmp_path):
+    path = tmp_path / 'chart.png'
+    path.write_bytes(os.urandom(100_000))
+    return path
+
+def test_response_streams_a_png_evicted_after_it_was_built(service, png):
+    result = {'success': True, 'charts': {'1D': {'base64_image': service.InlineImage(str(png))}}}
+    expected = base64.b64encode(png.read_bytes()).decode('ascii')
+    
+    response = service.json_response(result)
+    os.remove(png)
+    body = b''.join(response.response)
+    response.close()
+    
+    assert json.loads(body)['charts']['1D']['base64_image'] == expected
+
+def test_response_for_an_already_evicted_png_fails_before_sending(service, png):
+    result = {'charts': [{'base64_image': service.InlineImage(str(png))},
+                         {'base64_image': service.InlineImage(str(png) + '.gone')}]}
+    
+    with pytest.raises(FileNotFoundError):
+        service.json_response(result)
+    assert result['charts'][0]['base64_image']._file is None
+
+def test_closing_the_response_releases_the_handles(service, png):
+    image = service.InlineImage(str(png))
+    
+    response = service.json_response({'base64_image': image})
+    assert image._file is not None
+    response.close()
+    assert image._file is None
+
+def test_an_open_image_can_be_streamed_more_than_once(service, png):
+    image = service.InlineImage(str(png))
+    image.open()
+    try:
+        assert str(image) == str(image) == base64.b64encode(png.read_bytes()).decode('ascii')
+    finally:
+        image.close()
@@ -0,0 +1,29 @@
+"""Prometheus text rendering of directly updated and callback metrics"""
+
+def test_callback_counter_renders_as_a_counter(service):
+    total = {'value': 3}
+    counter = service.Counter('chart_things_total', 'Things', callback=lambda: total['value'])
+    
+    assert counter.render() == ['# HELP chart_things_total Things', '# TYPE chart_things_total counter',
+                                'chart_things_total 3']
+    total['value'] = 5
+    assert counter.render()[-1] == 'chart_things_total 5'
+
+def test_callback_values_by_label(service):
+    gauge = service.Gauge('chart_depth', 'Depth', ('lane',), callback=lambda: {'bulk': 2, 'webhook': None})
+    
+    assert gauge.render()[2:] == ['chart_depth{lane="bulk"} 2']
+
+def test_directly_updated_counter(service):
+    counter = service.Counter('chart_calls_total', 'Calls', ('interval',))
+    counter.inc(interval='1D')
+    counter.inc(2, interval='1D')
+    
+    assert counter.render()[2:] == ['chart_calls_total{interval="1D"} 3']
+
+def test_running_totals_are_exported_as_counters(service):
+    text = service.metrics.render()
+    
+    assert '# TYPE chart_circuit_breaker_short_circuited_total counter' in text
+    assert '# TYPE chart_shared_cache_served_total counter' in text
+    assert '# TYPE chart_single_flight_coalesced_total counter' in text
@@ -0,0 +1,50 @@
+"""Cache expiry: when the bar a chart was rendered on closes"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+def market_time(service, *args):
+    return datetime(*args, tzinfo=service.MARKET_TZ)
+
+@pytest.mark.parametrize('interval, now, expected', [
+    ('1h', (2025, 3, 5, 10, 15), (2025, 3, 5, 11, 0)),
+    ('1h', (2025, 3, 5, 10, 0), (2025, 3, 5, 11, 0)),
+    ('15m', (2025, 3, 5, 10, 44, 59), (2025, 3, 5, 10, 45)),
+    ('60', (2025, 3, 5, 23, 30), (2025, 3, 6, 0, 0)),
+])
+def test_intraday_bars_close_on_the_next_multiple_of_their_length(service, interval, now, expected):
+    assert service.next_bar_close(interval, market_time(service, *now)) == market_time(service, *expected)
+
+@pytest.mark.parametrize('now, expected', [
+    ((2025, 3, 5, 9, 30), (2025, 3, 5, 16, 0)),   # Wednesday, session open
+    ((2025, 3, 5, 16, 0), (2025, 3, 6, 16, 0)),   # exactly at the close
+    ((2025, 3, 7, 17, 0), (2025, 3, 10, 16, 0)),  # Friday evening -> Monday
+    ((2025, 3, 8, 12, 0), (2025, 3, 10, 16, 0)),  # Saturday -> Monday
+])
+def test_daily_bars_close_at_the_next_weekday_session_close(service, now, expected):
+    assert service.next_bar_close('1D', market_time(service, *now)) == market_time(service, *expected)
+
+@pytest.mark.parametrize('now, expected', [
+    ((2025, 3, 3, 9, 0), (2025, 3, 7, 16, 0)),    # Monday -> that Friday
+    ((2025, 3, 7, 15, 59), (2025, 3, 7, 16, 0)),
+    ((2025, 3, 7, 16, 0), (2025, 3, 14, 16, 0)),  # Friday close -> next Friday
+    ((2025, 3, 9, 12, 0), (2025, 3, 14, 16, 0)),  # Sunday
+])
+def test_weekly_bars_close_at_fridays_session_close(service, now, expected):
+    assert service.next_bar_close('1W', market_time(service, *now)) == market_time(service, *expected)
+
+def test_times_in_other_zones_are_converted_to_market_time(service):
+    # 21:30 UTC on Wednesday 2025-03-05 is 16:30 EST, after the close
+    now = datetime(2025, 3, 5, 21, 30, tzinfo=timezone.utc)
+    assert service.next_bar_close('1D', now) == market_time(service, 2025, 3, 6, 16, 0)
+
+def test_dst_change_keeps_the_session_close_in_market_time(service):
+    # US clocks go forward on Sunday 2025-03-09
+    close = service.next_bar_close('1D', market_time(service, 2025, 3, 7, 17, 0))
+    assert (close.hour, close.minute) == (16, 0)
+    assert close.utcoffset() != market_time(service, 2025, 3, 7, 17, 0).utcoffset()
+
+def test_unknown_intervals_fall_back_to_the_default_ttl(service):
+    now = market_time(service, 2025, 3, 5, 10, 0)
+    assert (service.next_bar_close('1M', now) - now).total_seconds() == service.CHART_CACHE_DEFAULT_TTL
@@ -0,0 +1,55 @@
+"""The pre-warmer stops issuing upstream calls when the service shuts down"""
+
+import threading
+import time
+
+import pytest
+
+@pytest.fixture
+def prewarmer(service, tmp_path, monkeypatch):
+    monkeypatch.setattr(service, 'chart_executor', service.RenderPool(1, 'test-render'))
+    return service.ChartPrewarmer(['AAPL', 'MSFT', 'NVDA', 'TSLA', 'AMZN'], service.resolve_timeframes(['1D']),
+                                  delay=0, spread=0, concurrency=3, daily_budget=100, reserve=0,
+                                  max_failures=10, lock_path=str(tmp_path / 'prewarm.lock'))
+
+def test_stop_submits_no_more_renders(service, prewarmer, monkeypatch):
+    release = threading.Event()
+    rendered = []
+    futures = []
+    
+    def render(symbol, timeframe, options):
+        release.wait(5)
+        rendered.append(symbol)
+        return True, {'cache': 'miss'}
+    
+    def submit(lane, fn, *args, submit=service.chart_executor.submit):
+        futures.append(submit(lane, fn, *args))
+        return futures[-1]
+    
+    monkeypatch.setattr(service, 'generate_timeframe_chart', render)
+    monkeypatch.setattr(service.chart_executor, 'submit', submit)
+    cycle = {}
+    runner = threading.Thread(target=lambda: cycle.update(prewarmer.run_cycle(prewarmer.timeframes)))
+    runner.start()
+    deadline = time.monotonic() + 5
+    while service.chart_executor.stats()['queued'] < 2:
+        assert runner.is_alive() and time.monotonic() < deadline
+        time.sleep(0.001)
+    
+    prewarmer.stop()
+    release.set()
+    runner.join(5)
+    
+    assert cycle['stopped'] == 'shutdown'
+    assert cycle['submitted'] == len(futures) == 3
+    # Queued renders are cancelled, or had already started; neither counts as a failure
+    cancelled = sum(future.cancelled() for future in futures)
+    assert cycle['rendered'] == len(rendered) == 3 - cancelled
+    assert cycle['failed'] == 0
+
+def test_stop_ends_the_scheduler_thread(prewarmer):
+    prewarmer.start()
+    assert prewarmer._thread.is_alive()
+    
+    prewarmer.stop(timeout=5)
+    assert not prewarmer._thread.is_alive()
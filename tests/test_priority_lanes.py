@@ -0,0 +1,97 @@
+"""Priority lanes: the rate limiter's token heap and the render pool queue"""
+
+import threading
+import time
+
+import pytest
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+def queue_in_order(limiter, lanes):
+    """Queue one acquire per lane, in order, behind a pause; returns the grant order"""
+    granted = []
+    lock = threading.Lock()
+    
+    def acquire(name, lane):
+        limiter.acquire(lane)
+        with lock:
+            granted.append(name)
+    
+    limiter.throttle(0.2)
+    threads = []
+    for i, lane in enumerate(lanes):
+        thread = threading.Thread(target=acquire, args=(f'{lane}-{i}', lane))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: limiter.stats()['queue_depth'] == i + 1)
+    for thread in threads:
+        thread.join(5)
+    return granted
+
+def test_tokens_go_to_higher_priority_lanes_first(service):
+    limiter = service.UpstreamRateLimiter(rate_per_second=50, burst=1, daily_budget=100, max_wait=5)
+    
+    granted = queue_in_order(limiter, ['bulk', 'background', 'bulk', 'webhook', 'interactive'])
+    
+    assert granted == ['interactive-4', 'webhook-3', 'bulk-0', 'bulk-2', 'background-1']
+    assert limiter.stats()['granted_by_lane'] == {'interactive': 1, 'webhook': 1, 'bulk': 2, 'background': 1}
+
+def test_same_lane_is_first_come_first_served(service):
+    limiter = service.UpstreamRateLimiter(rate_per_second=50, burst=1, daily_budget=100, max_wait=5)
+    
+    assert queue_in_order(limiter, ['webhook'] * 4) == ['webhook-0', 'webhook-1', 'webhook-2', 'webhook-3']
+
+def test_unknown_lanes_queue_with_the_lowest_priority(service):
+    limiter = service.UpstreamRateLimiter(rate_per_second=50, burst=1, daily_budget=100, max_wait=5)
+    
+    assert queue_in_order(limiter, ['nightly', 'background']) == ['nightly-0', 'background-1']
+    assert queue_in_order(limiter, ['nightly', 'bulk']) == ['bulk-1', 'nightly-0']
+
+def test_spent_daily_budget_fails_immediately(service):
+    limiter = service.UpstreamRateLimiter(rate_per_second=50, burst=5, daily_budget=2, max_wait=5)
+    limiter.acquire()
+    limiter.acquire()
+    
+    started = time.monotonic()
+    with pytest.raises(service.RateLimitExceeded, match='budget'):
+        limiter.acquire('interactive')
+    assert time.monotonic() - started < 0.1
+    assert limiter.remaining_today() == 0
+
+def test_a_caller_that_gives_up_leaves_the_queue(service):
+    limiter = service.UpstreamRateLimiter(rate_per_second=0.01, burst=1, daily_budget=100, max_wait=0.05)
+    limiter.acquire()
+    
+    with pytest.raises(service.RateLimitExceeded, match='Waited'):
+        limiter.acquire('bulk')
+    assert limiter.stats()['queue_depth'] == 0
+    assert limiter.stats()['rejected'] == 1
+
+def test_render_pool_starts_queued_renders_in_lane_order(service):
+    pool = service.RenderPool(1, 'test-render')
+    release = threading.Event()
+    started = []
+    
+    blocker = pool.submit('bulk', release.wait, 5)
+    wait_until(lambda: pool.running() == 1)
+    futures = [pool.submit(lane, started.append, f'{lane}-{i}')
+               for i, lane in enumerate(['bulk', 'background', 'webhook', 'interactive', 'bulk'])]
+    assert pool.stats()['queued_by_lane'] == {'interactive': 1, 'webhook': 1, 'bulk': 2, 'background': 1}
+    
+    release.set()
+    for future in [blocker] + futures:
+        future.result(5)
+    
+    assert started == ['interactive-3', 'webhook-2', 'bulk-0', 'bulk-4', 'background-1']
+    assert pool.stats()['queued'] == 0
+
+def test_render_pool_passes_results_and_exceptions_through_futures(service):
+    pool = service.RenderPool(2, 'test-render')
+    
+    assert pool.submit('webhook', sum, [1, 2, 3]).result(5) == 6
+    with pytest.raises(ZeroDivisionError):
+        pool.submit('webhook', lambda: 1 / 0).result(5)
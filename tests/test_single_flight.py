@@ -0,0 +1,104 @@
+"""Request coalescing: concurrent calls for one key share an execution"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+def run_concurrently(flight, key, fn, callers, **kwargs):
+    """Start callers threads on flight.do(key, fn) while fn is blocked; returns their outcomes"""
+    release = threading.Event()
+    
+    def blocked():
+        release.wait(5)
+        return fn()
+    
+    with ThreadPoolExecutor(callers) as pool:
+        futures = [pool.submit(flight.do, key, blocked, **kwargs)]
+        # The first caller leads; the rest join once it is in flight
+        while flight.stats()['in_flight'] == 0:
+            time.sleep(0.001)
+        futures += [pool.submit(flight.do, key, blocked, **kwargs) for _ in range(callers - 1)]
+        while flight.stats()['coalesced'] < callers - 1:
+            time.sleep(0.001)
+        release.set()
+        return [future.exception() or future.result() for future in futures]
+
+def test_concurrent_callers_share_one_execution(service):
+    flight = service.SingleFlight()
+    calls = []
+    
+    outcomes = run_concurrently(flight, 'k', lambda: calls.append(1) or 'chart', 5, label='1D')
+    
+    assert calls == [1]
+    assert outcomes[0] == ('chart', False)
+    assert outcomes[1:] == [('chart', True)] * 4
+    assert flight.stats() == {'in_flight': 0, 'executed': 1, 'lookup_hits': 0, 'coalesced': 4,
+                              'coalesced_by_interval': {'1D': 4}}
+
+def test_followers_receive_the_leaders_exception(service):
+    flight = service.SingleFlight()
+    
+    def fail():
+        raise ValueError('upstream refused')
+    
+    outcomes = run_concurrently(flight, 'k', fail, 3)
+    
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert flight.stats()['in_flight'] == 0
+
+def test_nothing_is_remembered_after_completion(service):
+    flight = service.SingleFlight()
+    results = iter(['first', 'second'])
+    
+    assert flight.do('k', lambda: next(results)) == ('first', False)
+    assert flight.do('k', lambda: next(results)) == ('second', False)
+    assert flight.stats()['executed'] == 2
+
+def test_distinct_keys_do_not_coalesce(service):
+    flight = service.SingleFlight()
+    
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('b', lambda: 2) == (2, False)
+    assert flight.stats()['coalesced'] == 0
+
+def test_leader_uses_the_lookup_result_instead_of_calling_fn(service):
+    flight = service.SingleFlight()
+    
+    def fetch():
+        pytest.fail('fn must not run when lookup has a result')
+    
+    assert flight.do('k', fetch, lookup=lambda: 'cached') == ('cached', False)
+    assert flight.stats()['lookup_hits'] == 1
+    assert flight.stats()['executed'] == 0
+
+def test_leader_calls_fn_when_lookup_finds_nothing(service):
+    flight = service.SingleFlight()
+    
+    assert flight.do('k', lambda: 'fresh', lookup=lambda: None) == ('fresh', False)
+    assert flight.stats()['lookup_hits'] == 0
+    assert flight.stats()['executed'] == 1
+
+def test_followers_share_a_lookup_hit(service):
+    flight = service.SingleFlight()
+    release = threading.Event()
+    
+    def lookup():
+        release.wait(5)
+        return 'cached'
+    
+    def fetch():
+        pytest.fail('fn must not run when lookup has a result')
+    
+    with ThreadPoolExecutor(3) as pool:
+        leader = pool.submit(flight.do, 'k', fetch, lookup=lookup)
+        while flight.stats()['in_flight'] == 0:
+            time.sleep(0.001)
+        followers = [pool.submit(flight.do, 'k', fetch, lookup=lookup) for _ in range(2)]
+        while flight.stats()['coalesced'] < 2:
+            time.sleep(0.001)
+        release.set()
+    
+    assert leader.result() == ('cached', False)
+    assert [follower.result() for follower in followers] == [('cached', True)] * 2
@@ -0,0 +1,56 @@
+"""Latency samples for streamed upstream calls cover the body download"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+BODY_DELAY = 0.3
+
+class SlowBodyHandler(BaseHTTPRequestHandler):
+    """Sends the headers at once and the body after BODY_DELAY"""
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', '4')
+        self.end_headers()
+        self.wfile.flush()
+        time.sleep(BODY_DELAY)
+        self.wfile.write(b'\x89PNG')
+    
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def upstream_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowBodyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(service):
+    tracker = service.LatencyTracker(window=10, min_samples=1, default_timeout=5.0,
+                                     min_timeout=1.0, max_timeout=10.0, multiplier=2.0)
+    return service.ChartImgClient('key', pool_size=2, max_retries=0, backoff_base=0.1,
+                                  backoff_max=0.1, retry_after_max=1.0, latency_tracker=tracker)
+
+def test_streamed_sample_is_recorded_after_the_body(client, upstream_url):
+    with client.post(upstream_url, b'{}', timeout=5.0, label='1h', stream=True) as response:
+        assert client.latency_tracker.percentile('1h', 50) is None
+        assert b''.join(client.timed_content(response, 2)) == b'\x89PNG'
+    
+    assert client.latency_tracker.percentile('1h', 50) >= BODY_DELAY
+
+def test_unread_streamed_response_is_not_sampled(client, upstream_url):
+    client.post(upstream_url, b'{}', timeout=5.0, label='1h', stream=True).close()
+    assert client.latency_tracker.intervals() == []
+
+def test_buffered_sample_includes_the_body(client, upstream_url):
+    client.post(upstream_url, b'{}', timeout=5.0, label='1h')
+    assert client.latency_tracker.percentile('1h', 50) >= BODY_DELAY